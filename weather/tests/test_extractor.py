@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+"""
+WeatherExtractor storage roundtrip tests.
+"""
+
+from .. import weather
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+
+def _make_extractor():
+    """ Build an extractor with a small synthetic message frame whose
+    validDateTime order differs from insertion order, so sort_index
+    permutes the rows the way a real grib load with derived parameters
+    does. """
+    lats = np.array([45., 46.], dtype=np.float32)
+    lons = np.array([14., 15.], dtype=np.float32)
+    rows = []
+    val = 0.
+    for day in [2, 1, 3]:
+        for hour in [0, 6, 12, 18]:
+            for param in ['2t', 'tp']:
+                rows.append({
+                    'shortName': param,
+                    'values': np.array([val, val + 1.], dtype=np.float32),
+                    'validDateTime': datetime.datetime(2020, 1, day),
+                    'validityDateTime': datetime.datetime(2020, 1, day, hour),
+                    'lats': lats, 'lons': lons, 'type': 'fc'})
+                val += 2.
+    we = weather.WeatherExtractor()
+    we.grib_msgs = pd.DataFrame.from_dict(rows)
+    we._normalize_storage()
+    we.grib_msgs.set_index('validDateTime', drop=False, inplace=True)
+    we.grib_msgs.sort_index(inplace=True)
+    return we
+
+
+def _values_by_key(we):
+    """ Map each (base date, validity date, parameter) to its value array. """
+    return {
+        (row.validDateTime, row.validityDateTime, row.shortName):
+            np.asarray(row['values'])
+        for _, row in we.grib_msgs.iterrows()}
+
+
+class TestStoreLoadRoundtrip(unittest.TestCase):
+    """ Unit tests for WeatherExtractor.store / load roundtrips. """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_roundtrip(self, filename):
+        """ Store, reload and compare every message's values by key. """
+        we = _make_extractor()
+        filepath = os.path.join(self.tmpdir, filename)
+        we.store(filepath)
+
+        reloaded = weather.WeatherExtractor()
+        reloaded.load(filepath)
+
+        expected = _values_by_key(we)
+        actual = _values_by_key(reloaded)
+        self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+        for key, values in expected.items():
+            np.testing.assert_array_equal(
+                values, actual[key], err_msg='values mismatch for %s' % (key,))
+
+    def test_pkl_roundtrip(self):
+        """ Values stay attached to the right message through a pkl store/load. """
+        self._check_roundtrip('data.pkl')
+
+    def test_feather_roundtrip(self):
+        """ Values stay attached to the right message through a feather store/load. """
+        self._check_roundtrip('data.feather')
+
+    def test_missing_sidecar(self):
+        """ Loading a stored file without its .npy sidecar fails with a clear error. """
+        we = _make_extractor()
+        filepath = os.path.join(self.tmpdir, 'data.pkl')
+        we.store(filepath)
+        os.remove(filepath + '.npy')
+
+        reloaded = weather.WeatherExtractor()
+        with self.assertRaises(FileNotFoundError):
+            reloaded.load(filepath)
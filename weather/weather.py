@@ -1,955 +1,1356 @@
-#!/usr/bin/python
-"""
-Module for downloading and using ECMWF weather data.
-
-There are two important classes:
-    * WeatherApi: used for downloading GRIB files from MARS
-    * WeatherExtractor: used for querying weather data from a pre-downloaded GRIB file
-
-Example:
-    Examples of class usages are given in class docstring.
-
-Todo:
-    * add interpolation capability to WeatherExtractor._aggregate_points
-"""
-from __future__ import print_function
-import datetime
-import math
-import json
-import pickle
-from collections import defaultdict
-
-import numpy as np
-import pandas as pd
-
-"""
-    Best estimation for actual weather is forecast with a base date on the current day.
-
-    Parameter name:                 Short name:
-
-    2 metre dewpoint temperature        2d
-    2 metre temperature                 2t
-    10 metre U wind component           10u
-    10 metre V wind component           10v
-    Precipitation type**                ptype
-    Snow depth                          sd
-    Snow fall                           sf
-    Sunshine duration*                  sund
-    Surface pressure                    sp
-    Total cloud cover                   tcc
-    Total precipitation*                tp
-    Visibility [m]                      vis
-
-    Wind speed*** [m/s]                 ws
-    Relative humidity*** [%]            rh
-
-    *accumulated from the beginning of the forecast
-    **mean aggregation of this parameter makes no sense
-    ***calculated parameter
-
-    Precipitation type (ptype) code table:
-        0 = No precipitation
-        1 = Rain
-        3 = Freezing rain (i.e. supercooled)
-        5 = Snow
-        6 = Wet snow (i.e. starting to melt)
-        7 = Mixture of rain and snow
-        8 = Ice pellets
-
-    Warning:
-        * after 2015-5-13 number of parameters changes
-"""
-class WeatherExtractor:
-    """
-    Interface for extracting weather data from pre-downloaded GRIB file.
-    Each GRIB file is a collection of self contained weather messages.
-
-    It supports actual weather queries ( via .get_actual(...) ) and forecasted weather
-    queries ( via .get_forecast(...) )
-
-    Examples
-        $ we = WeatherExtractor()
-        $ we.load('example_data.grib')
-
-        Queries about actual weather have the following format:
-
-            $ wa.get_actual(from_date, to_date, aggtime)
-
-            Where:
-                from_date, to_date: time window in days
-                aggtime: aggregation of weather data on different levels:
-                    aggtime='hour': aggregate by hour
-                    aggtime='day': aggregation by day
-                    aggtime='week': aggregation by week
-
-        Queries about forecasted weather have the following format:
-
-            $ wa.get_forecast(base_date, from_date, to_date, aggtime)
-
-            Where:
-                from_date, to_date: time window in days
-                aggtime: aggregation of weather data on different levels:
-                    aggtime='hour': aggregate by hour
-                    aggtime='day': aggregation by day
-                    aggtime='week': aggregation by week
-
-    """
-
-    def __init__(self):
-        self.grib_msgs = None
-
-    def _load_from_grib(self, filepath, grib_reader):
-        """ Load measurements from GRIB file. """
-        # load grib messages
-        grib_messages = []
-        lats, lons = None, None
-
-        if grib_reader[1] == 'eccodes':
-            grbs = grib_reader[0](filepath)
-            for i in range(len(grbs)):
-                grib_msg = grbs.next()
-
-                if lats is None:
-                    lats = grib_msg['latitudes'].flatten()
-                    lons = grib_msg['longitudes'].flatten()
-
-                grib_messages.append({
-                    'shortName': grib_msg['shortName'],
-                    'values': grib_msg['values'].flatten(),
-                    'validDateTime': WeatherExtractor._str_to_datetime(
-                        str(grib_msg['date']) + str(grib_msg['time'])),
-                    'validityDateTime': WeatherExtractor._str_to_datetime(
-                        str(grib_msg['validityDate']) + str(grib_msg['validityTime'])),
-                    'lats': lats,
-                    'lons': lons,
-                    'type': grib_msg['marsType']  # forecast or actual
-                })
-            grbs.close()
-        else:
-            grbs = grib_reader[0](filepath)
-        
-            lats, lons = grbs.message(1).latlons()
-            lats, lons = lats.flatten(), lons.flatten()
-            
-            grbs.rewind()
-            for grib_msg in grbs:
-                grib_messages.append({
-                    'shortName': grib_msg.shortName,
-                    'values': grib_msg.values.flatten(),
-                    'validDateTime': grib_msg.validDate,
-                    'validityDateTime': WeatherExtractor._str_to_datetime(
-                        str(grib_msg.validityDate) + str(grib_msg.validityTime)),
-                    'lats': lats,
-                    'lons': lons,
-                    'type': grib_msg.marsType  # forecast or actual
-                })
-            grbs.close()
-        return pd.DataFrame.from_dict(grib_messages)
-
-    def _load_from_pkl(self, filepath):
-        """ Load already processed pandas.DataFrame. """
-        with open(filepath, 'rb') as f:
-            return pickle.load(f)
-
-    def _load_from_owmjson(self, filepath):
-        """ Load measurements from OpenWeatherMap json response. """
-        # Convert to the same 'grib messages' format as ecmwf data
-        grib_messages = []
-        
-        with open(filepath, 'r') as f:
-            d = json.loads(f.read())
-        
-        lats = [d['city']['coord']['lat']]
-        lons = [d['city']['coord']['lon']]
-        validDateTime = pd.to_datetime(d['list'][0]['dt_txt'])
-
-        def __add_msg(name, value, validityDateTime):
-            grib_messages.append({
-                'shortName': name,
-                'values': np.array([value]),
-                'validDateTime': pd.to_datetime(validDateTime.date()),
-                'validityDateTime': validityDateTime,
-                'lats': lats,
-                'lons': lons,
-                'type': 'fc'
-            })
-
-        # Total precipitation is accumulated parameter in ECMWF (in [m])
-        # make it accumulated also for OWM
-        tp_acc = 0.0
-
-        for msg in d['list']:
-            validityDateTime = pd.to_datetime(msg['dt_txt'])
-            
-            __add_msg('2t', msg['main']['temp'], validityDateTime)
-            __add_msg('rh', msg['main']['humidity'] / 100.0, validityDateTime)
-            __add_msg('sp', msg['main']['grnd_level'] / 100.0, validityDateTime)
-            __add_msg('tcc', msg['clouds']['all'] / 100.0 if 'clouds' in msg else 0.0, validityDateTime)
-            __add_msg('ws', msg['wind']['speed'] if 'wind' in msg else 0.0, validityDateTime)
-            if 'rain' in msg and '3h' in msg['rain']:
-                tp_acc += msg['rain']['3h'] / 1000.0 # in [mm] originally
-            __add_msg('tp', tp_acc, validityDateTime)
-            __add_msg('sf', msg['snow']['3h'] / 100.0 if 'snow' in msg else 0.0, validityDateTime)
-            
-        return pd.DataFrame.from_dict(grib_messages)
-
-    def load(self, filepaths, format=None):
-        """
-        Load weather data from grib file obtained via API request or from
-        the pickled pandas.DataFrame.
-
-        Arguments:
-            filepaths (list): list of paths to files containing weather data
-            format (str): one of the following:
-                'grib': files are stored in grib format
-                'pkl': files are stored in binary form (pickled)
-                'owm': files are stored in OpenWeatherMap json format
-
-                if format is not specified it is automatically inferred from file prefix
-                (.grib, .pkl or .json)
-        
-        Warning:
-            after 2015-5-13 number of parameters increases from 11 to 15 and
-            additional parameter 'ptype' which disturbs the indexing
-            (because of inconsistent 'validDateTime') sneaks in
-        """
-        if not isinstance(filepaths, list):
-            filepaths = [filepaths]  # wrap in list
-        
-        grib_reader = None
-        if format is None:
-            if all(f.endswith('.grib') for f in filepaths):
-                format = 'grib'
-
-                try:
-                    import eccodes
-                    grib_reader = (eccodes.GribFile, 'eccodes')
-                except ImportError:
-                    import pygrib
-                    grib_reader = (pygrib.open, 'pygrib')
-                print('Using ', grib_reader[1], ' as GRIB decoder.')
-
-            elif all(f.endswith('.pkl') for f in filepaths):
-                format = 'pkl'
-            elif all(f.endswith('.json') for f in filepaths):
-                format = 'owm'
-            else:
-                raise ValueError("Could not infer the file format.")
-
-        for filepath in filepaths:
-            curr_msgs = None
-
-            if format == 'grib':
-                curr_msgs = self._load_from_grib(filepath, grib_reader)
-            elif format == 'pkl':
-                curr_msgs = self._load_from_pkl(filepath)
-            elif format == 'owm':
-                curr_msgs = self._load_from_owmjson(filepath)
-            else:
-                raise ValueError("Format %s not recognized" % format)
-
-            # append messages
-            if self.grib_msgs is None:
-                self.grib_msgs = curr_msgs
-            else:
-                self.grib_msgs = pd.concat([self.grib_msgs, curr_msgs])
-
-            # reset index
-            self.grib_msgs.reset_index(drop=True, inplace=True)
-
-        # extend the set of parameters if data is from grib files
-        if format == 'grib':
-            self.grib_msgs = WeatherExtractor._extend_parameters(self.grib_msgs)
-
-        # index by base date (date when the forecast was made)
-        self.grib_msgs.set_index('validDateTime', drop=False, inplace=True)
-        self.grib_msgs.sort_index(inplace=True)
-
-    def store(self, filepath):
-        if not filepath.endswith('.pkl'):
-            filepath += '.pkl'
-        print("Saving weather data to: %s" % filepath)
-        with open(filepath, 'wb') as f:
-            pickle.dump(self.grib_msgs, f)
-
-    @staticmethod
-    def _extend_parameters(grib_msgs):
-        """ Extend the set of weather parameters with ones calculated
-        from base parameters.
-        """
-        print("Extending parameters...")
-        curr_params = np.unique(grib_msgs.shortName)
-        # calculate Wind speed [ws] parameter
-        if ('10u' in curr_params) and '10v' in curr_params and not 'ws' in curr_params:
-            # print "Calculating parameter Wind speed (ws)"
-            grp = grib_msgs[(grib_msgs.shortName == '10u') | (grib_msgs.shortName == '10v')].reset_index(drop=True).groupby(['validDateTime', 'validityDateTime'])
-
-            new_msgs = []
-            for group in grp.groups:
-                tf = grp.get_group(group)
-                new_msgs.append({
-                    'shortName': u'ws',
-                    'values': np.sqrt(np.sum(v*v for v in tf['values'])),
-                    'validDateTime': tf['validDateTime'].iloc[0],
-                    'validityDateTime': tf['validityDateTime'].iloc[0],
-                    'lats': tf['lats'].iloc[0],
-                    'lons': tf['lons'].iloc[0],
-                    'type': tf['type'].iloc[0]
-                })
-
-            new_msgs = pd.DataFrame.from_dict(new_msgs)
-            grib_msgs = grib_msgs.append(new_msgs)
-
-        # calculate Relative humidity (rh) parameter
-        if '2t' in curr_params and '2d' in curr_params and not 'rh' in curr_params:
-            T0 = 273.15
-
-            # get dewpoint temperature and surface temperature
-            grp = grib_msgs[(grib_msgs.shortName == '2t') | (grib_msgs.shortName == '2d')].reset_index(drop=True).groupby(['validDateTime', 'validityDateTime'])
-
-            new_msgs = []
-            for group in grp.groups:
-                tf = grp.get_group(group)
-                T_surface = tf[tf.shortName == '2t'].iloc[0]['values'] - T0
-                T_dew = tf[tf.shortName == '2d'].iloc[0]['values'] - T0
-
-                # calculate relative humidity using https://journals.ametsoc.org/doi/pdf/10.1175/BAMS-86-2-225
-                rh = 100*(np.exp((17.625*T_dew)/(243.04+T_dew))/np.exp((17.625*T_surface)/(243.04+T_surface)))
-                new_msgs.append({
-                    'shortName': u'rh',
-                    'values': rh,
-                    'validDateTime': tf['validDateTime'].iloc[0],
-                    'validityDateTime': tf['validityDateTime'].iloc[0],
-                    'lats': tf['lats'].iloc[0],
-                    'lons': tf['lons'].iloc[0],
-                    'type': tf['type'].iloc[0]
-                })
-            new_msgs = pd.DataFrame.from_dict(new_msgs)
-            grib_msgs = grib_msgs.append(new_msgs)
-
-        return grib_msgs
-
-    def _latslons_from_dict(self, points):
-        """ Get lattitudes and longtitudes from list of points. """
-        assert isinstance(points, list)
-
-        n_points = len(points)
-        lats, lons = np.zeros(n_points), np.zeros(n_points)
-        for i, point in enumerate(points):
-            lats[i], lons[i] = point['lat'], point['lon']
-        return (lats, lons)
-
-    def _calc_closest(self, lats, lons, target_lats, target_lons):
-        """
-        For each point Pi = (lats[i], lons[i]) calculate the closest point Pj = (target_lats[j], target_lons[j])
-        according to euclidean distance. In case of a tie take the first point with minimum distance.
-
-        Args:
-            lats, lons (np.array(dtype=float)): latitudes and longtitudes of original points
-            target_lats, target_lons (np.array(dtype=float)): latitudes and longtitudes of target points
-
-        Returns:
-            np.array(dtype=int): array where value at index i represents the index of closest point j
-        """
-        num_points = lats.shape[0]
-        num_target = target_lats.shape[0]
-
-        closest = np.zeros(num_points, dtype=np.int)
-        for i in range(num_points):
-            best_dist = (lats[i] - target_lats[0])**2 + \
-                (lons[i] - target_lons[0])**2
-            for j in range(1, num_target):
-                curr_dist = (lats[i] - target_lats[j])**2 + \
-                    (lons[i] - target_lons[j])**2
-                if curr_dist < best_dist:
-                    best_dist = curr_dist
-                    closest[i] = j
-        return closest
-
-    def _interpolate_values(self, values, closest, num_original, num_targets, aggtype):
-        """
-        Do a value interpolation for given target points according to aggregation type.
-
-        Args:
-            values (np.array(dtype=float)): original values
-            closest (np.array(dtype=int)):
-            num_original (int):
-            num_targets (int):
-            aggtype (str):
-
-        Returns:
-            np.array(dtype=float): interpolated values for target points
-        """
-        # get interpolated values
-        result_values = np.zeros(num_targets)
-        if aggtype == 'one':
-            for i in range(num_targets):
-                result_values[i] = values[closest[i]]
-        elif aggtype == 'mean':
-            result_count = np.zeros(num_targets)
-            for i in range(num_original):
-                result_values[closest[i]] += values[i]
-                result_count[closest[i]] += 1.
-            result_count[result_count == 0] = 1.  # avoid dividing by zero
-            result_values /= result_count
-        return result_values
-
-    @staticmethod
-    def _str_to_datetime(val):
-        """ Convert datetime string 'YYYYMMDDHHMM' to datetime object. """
-        tmp_date = datetime.date(int(val[:4]), int(val[4:6]), int(val[6:8]))
-
-        time_str = val[8:]
-        assert len(time_str) in [1, 3, 4]
-        if len(time_str) == 1:
-            # midnight - only one number
-            return datetime.datetime.combine(tmp_date, datetime.time(int(time_str)))
-        elif len(time_str) == 3:
-            # hmm format
-            return datetime.datetime.combine(tmp_date, datetime.time(int(time_str[:1]), int(time_str[1:])))
-        elif len(time_str) == 4:
-            # hhmm format
-            return datetime.datetime.combine(tmp_date, datetime.time(int(time_str[:2]), int(time_str[2:])))
-
-    def _aggregate_points(self, weather_result, aggloc, aggtype='one', interp_points=None, bounding_box=None):
-        """
-        Do an interpolation of measurement values for target points (given with target_lats and target_lons)
-        from weather_result points.
-
-        Args:
-            weather_result (pandas.DataFrame): object containing original measurements and points
-            aggloc (str): aggregation level
-            aggtype (str): aggregation type, can be one of the following:
-
-                'one' - keep only the value of a grid point which is closest to the target point
-                'mean' - calculate the mean value of all grid points closest to the target point
-
-                TODO:
-                    'interpolate' - do a kind of ECMWF interpolation
-
-        Returns:
-            pandas.DataFrame: resulting object with interpolated points
-        """
-        assert aggloc in ['grid', 'points', 'country', 'bbox']
-        assert aggtype in ['one', 'mean']
-        if aggloc == 'points':
-            assert interp_points is not None
-        assert len(weather_result) > 0
-
-        lats, lons = weather_result['lats'].iloc[0], weather_result['lons'].iloc[0]
-
-        if aggloc == 'bbox':
-            assert bounding_box is not None, "bounding box not given"
-            assert len(bounding_box) == 2 and len(bounding_box[0]) == 2 and len(bounding_box[1]) == 2, \
-                "Wrong bounding box input structure"
-            # get bounding box borders
-            bb_min_lat = min(bounding_box[0][0], bounding_box[1][0])
-            bb_max_lat = max(bounding_box[0][0], bounding_box[1][0])
-            bb_min_lon = min(bounding_box[0][1], bounding_box[1][1])
-            bb_max_lon = max(bounding_box[0][1], bounding_box[1][1])
-            # get data borders
-            min_lat, max_lat = min(lats), max(lats)
-            min_lon, max_lon = min(lons), max(lons)
-            # check if bounding box is within data
-            assert min_lat <= bb_min_lat <= max_lat, "bounding box must be within data area"
-            assert min_lat <= bb_max_lat <= max_lat, "bounding box must be within data area"
-            assert min_lon <= bb_min_lon <= max_lon, "bounding box must be within data area"
-            assert min_lon <= bb_max_lon <= max_lon, "bounding box must be within data area"
-            # filter out bounding box points
-            tmp_lats, tmp_lons = [], []
-            for lat, lon in zip(lats, lons):
-                if bb_min_lat <= lat <= bb_max_lat and bb_min_lon <= lon <= bb_max_lon:
-                    tmp_lats.append(lat)
-                    tmp_lons.append(lon)
-            assert len(tmp_lats) > 0 and len(tmp_lons) > 0, "bounding box contains no points"
-            lats, lons = np.array(tmp_lats), np.array(tmp_lons)
-
-        if aggloc == 'grid':  # no aggregation
-            return weather_result
-        elif aggloc == 'points':
-            target_lats, target_lons = interp_points[0], interp_points[1]
-        elif aggloc == 'country':  # center of slovenia
-            target_lats, target_lons = np.array([46.1512]), np.array([14.9955])
-        elif aggloc == 'bbox': # aggregate over bounding box
-            # compute mid point of bounding box
-            mid_bbox = [0.5 * (bb_min_lat + bb_max_lat), 0.5 * (bb_min_lon + bb_max_lon)]
-            target_lats, target_lons = np.array([mid_bbox[0]]), np.array([mid_bbox[1]])
-
-        if aggtype == 'one':
-            # each target point has only one closest grid point
-            closest = self._calc_closest(target_lats, target_lons, lats, lons)
-        elif aggtype == 'mean':
-            # each grid point has only one closest target point
-            closest = self._calc_closest(lats, lons, target_lats, target_lons)
-
-        num_original = lats.shape[0]
-        num_targets = target_lats.shape[0]
-
-        # create new weather object
-        tmp_result = list()
-
-        columns = weather_result.columns
-        for raw_row in weather_result.itertuples(index=False):
-            row_data = dict()
-            for col_pos, col_str in enumerate(columns):
-                # affected columns are 'values', 'lats' and 'lons'
-                if col_str == 'values':
-                    row_data[col_str] = self._interpolate_values(
-                        raw_row[col_pos], closest, num_original, num_targets, aggtype)
-                elif col_str == 'lats':
-                    row_data[col_str] = target_lats
-                elif col_str == 'lons':
-                    row_data[col_str] = target_lons
-                else:
-                    row_data[col_str] = raw_row[col_pos]
-            tmp_result.append(row_data)
-
-        return pd.DataFrame.from_dict(tmp_result)
-
-    def _aggregate_values(self, weather_result, aggtime):
-        """
-        Aggregate weather values on hourly, daily or weekly level. Calculate the mean
-        value for each measurement point over given time period.
-
-        Serves more as an aggregation example. For more complex aggregations set aggtime='hour'
-        and implement own aggregation policy on pandas.DataFrame.
-
-        Args:
-            weather_result (pandas.DataFrame): object containing original measurements
-            aggtime (str): aggregation level which can be 'hour', 'day' or 'week'
-
-        Returns:
-            pandas.DataFrame: resulting object with aggregated values
-        """
-        assert aggtime in ['hour', 'day', 'week', 'H', 'D', 'W']
-        aggtime = {'hour': 'H', 'day': 'D', 'week': 'W'}[aggtime]
-
-        if aggtime == 'H':
-            return weather_result
-
-        weather_result.set_index(
-            ['validDateTime', 'validityDateTime', 'shortName'], drop=True, inplace=True)
-
-        groups = weather_result.groupby([pd.Grouper(freq='D', level='validDateTime'), pd.Grouper(
-            freq=aggtime, level='validityDateTime'), pd.Grouper(level='shortName')])
-
-        tmp_result = groups.apply(
-            lambda group:
-            pd.Series(
-                {
-                    'values': group['values'].mean(),
-                    'lats': group['lats'].iloc[0],
-                    'lons': group['lons'].iloc[0]
-                })
-        )
-        tmp_result.reset_index(drop=False, inplace=True)
-
-        return tmp_result
-
-    def get_actual(self, from_date, to_date, aggtime='hour', aggloc='grid', interp_points=None, bounding_box=None):
-        """
-        Get the actual weather for each day from a given time window.
-        Actual weather is actually a forecast made on given day - this is the best weather estimation
-        we can get.
-
-        Args:
-            from_date (datetime.date): start of the timewindow
-            to_date (datetime.date): end of the timewindow
-            aggtime (str): time aggregation level; can be 'hour', 'day' or 'week'
-            aggloc (str): location aggregation level; can be country', 'points', 'grid' or 'bbox'
-            interp_points (list of dicts): list of interpolation points with each point represented
-                as dict with fields 'lon' and 'lat' representing longtitude and lattitude if aggloc='points'
-            bounding_box ([[lat1,lon1], [lat2,lon2]]): corner points of the bounding box if aggloc='bounding_box',
-                order of the points is not important
-
-        Returns:
-            pandas.DataFrame: resulting object with weather measurements
-        """
-        assert type(from_date) == datetime.date
-        assert type(to_date) == datetime.date
-        assert from_date <= to_date
-        assert aggtime in ['hour', 'day', 'week']
-        assert aggloc in ['country', 'points', 'grid', 'bbox']
-
-        if aggloc == 'points':
-            if interp_points is None:
-                raise ValueError(
-                    "interp_points cannot be None if aggloc is set to 'points'.")
-            interp_points = self._latslons_from_dict(interp_points)
-        if aggloc == 'bounding_box':
-            if bounding_box is None:
-                raise ValueError(
-                    "bounding_box cannot be None if aggloc is set to 'bounding_box'.")
-
-        req_period = self.grib_msgs.loc[from_date:to_date]
-        tmp_result = req_period[req_period['validDateTime'].dt.date ==
-                                req_period['validityDateTime'].dt.date]
-
-        # drop 'type' column
-        tmp_result.drop('type', axis=1, inplace=True)
-
-        # reset original index
-        tmp_result.reset_index(drop=True, inplace=True)
-
-        # point aggregation
-        aggtype = 'mean' if aggloc == 'bbox' else 'one'
-        tmp_result = self._aggregate_points(
-            tmp_result, aggloc, aggtype=aggtype, interp_points=interp_points, bounding_box=bounding_box)
-
-        # time aggregation
-        tmp_result = self._aggregate_values(tmp_result, aggtime)
-
-        return tmp_result
-
-    def get_forecast(self, base_date, from_date, to_date, aggtime='hour', aggloc='grid', interp_points=None,
-        bounding_box=None):
-        """
-        Get the weather forecast for a given time window from a given date.
-
-        Args:
-            base_date (datetime.date): base date for the forecast
-            from_date (datetime.date): start of the time window
-            end_date (datetime.date): end of the timewindow
-            aggtime (str): time aggregation level; can be 'hour', 'day' or 'week'
-            aggloc (str): location aggregation level; can be 'country', 'points', 'grid' or 'bbox'
-            interp_points (list of dicts): list of interpolation points with each point represented
-                as dict with fields 'lon' and 'lat' representing longtitude and lattitude if aggloc='points'
-            bounding_box ([[lat1,lon1], [lat2,lon2]]): corner points of the bounding box if aggloc='bbox',
-                order of the points is not important
-
-        Returns:
-            pandas.DataFrame: resulting object with weather measurements
-        """
-        assert type(base_date) == datetime.date
-        assert type(from_date) == datetime.date
-        assert type(to_date) == datetime.date
-        assert base_date <= from_date <= to_date
-        assert aggtime in ['hour', 'day', 'week']
-        assert aggloc in ['country', 'points', 'grid', 'bbox']
-
-        if aggloc == 'points':
-            if interp_points is None:
-                raise ValueError(
-                    "interp_points cannot be None if aggloc is set to 'points'.")
-            interp_points = self._latslons_from_dict(interp_points)
-        if aggloc == 'bounding_box':
-            if bounding_box is None:
-                raise ValueError(
-                    "bounding_box cannot be None if aggloc is set to 'bounding_box'.")
-
-        req_period = self.grib_msgs.loc[base_date]
-
-        # start with default (hourly) aggregation
-        tmp_result = req_period[req_period['validityDateTime'].dt.date >= from_date]
-        tmp_result = tmp_result[tmp_result['validityDateTime'].dt.date <= to_date]
-
-        # drop 'type' column
-        tmp_result.drop('type', axis=1, inplace=True)
-
-        # reset original index
-        tmp_result.reset_index(drop=True, inplace=True)
-
-        # point aggregation
-        aggtype = 'mean' if aggloc == 'bbox' else 'one'
-        tmp_result = self._aggregate_points(
-            tmp_result, aggloc, aggtype=aggtype, interp_points=interp_points, bounding_box=bounding_box)
-
-        # time aggregation
-        tmp_result = self._aggregate_values(tmp_result, aggtime)
-
-        return tmp_result
-
-    def export_qminer(self, filename, interp_points):
-        """
-        Export weather features for each date from dates to .tsv file.
-
-        Args:
-            filename (str): name of target file
-            interp_points (list of dicts): list of interpolation points with each point represented
-                as dict with fields 'lon' and 'lat' representing longtitude and lattitude
-        Returns:
-            pandas.DataFrame: resulting object with weather measurements
-        """
-        # export all dates
-        dates = np.unique(sorted([dt.date() for dt in self.grib_msgs.validDateTime]))
-        # get interpolation points
-        lats, lons = self.grib_msgs.iloc[0]['lats'], self.grib_msgs.iloc[0]['lons']
-        target_lats, target_lons = self._latslons_from_dict(interp_points)
-        # only keep the values from closest point to each target
-        closest = self._calc_closest(target_lats, target_lons, lats, lons)
-        # weather features frame
-        tf = self.grib_msgs
-        # index on the predicted date
-        tf = tf.set_index('validityDateTime', drop=False)
-        tf = tf.sort_index()
-        # WARNING: there is something wrong with ptype parameter
-        tf = tf[tf.shortName != 'ptype']
-        # interpolate all values
-        tf['values'] = tf['values'].apply(lambda x: x[closest])
-
-        # generate new dataframe
-        rf = pd.DataFrame()
-        rf['param'] = tf['shortName']
-        rf['timestamp'] = tf['validityDateTime']
-        rf['dayOffset'] = (tf['validityDateTime'] - tf['validDateTime']).apply(lambda x: x.days)
-
-        # generate region values
-        for i in range(len(interp_points)):
-            rf[str(i)] = tf['values'].apply(lambda x: x[i])
-        # transform region values from columns to rows
-        rf = pd.melt(rf, id_vars=['param', 'timestamp', 'dayOffset'], var_name='region', value_name='value')
-        rf['region'] = pd.to_numeric(rf['region'])
-
-        rf.sort_values(by=['timestamp', 'region'], inplace=True)
-        rf.to_csv(filename, sep='\t', index=False)
-
-    def export_db(self, filename):
-        """
-        Export weather features to tsv file in MariaDB format.
-
-        Args:
-            filename (str): name of target file
-        Returns:
-            pandas.DataFrame: resulting object with weather measurements
-        """
-        # weather features frame
-        df = self.grib_msgs
-
-        def f(group):
-            item = group.iloc[0]
-            n = len(item.lats)
-
-            offset = math.trunc((item.validityDateTime - item.validDateTime).total_seconds() / 3600.0)
-            new_columns = {
-                'date': [item.validDateTime] * n,
-                'offset': [offset] * n,
-                'latitude': list(item.lats),
-                'longitude': list(item.lons)
-            }
-
-            for param_name, param_group in group.groupby('shortName'):
-                new_columns[param_name] = param_group.iloc[0]['values']
-
-            return pd.DataFrame(new_columns)
-
-        df = df.groupby(['validDateTime', 'validityDateTime'], as_index=False).apply(f)
-        df.sort_values(by=['date', 'offset'], inplace=True)
-        df.to_csv(filename, sep='\t', index=False)
-
-    def export(self, filename, interp_points, weather_params='all', forecast_offsets='all', regions='all'):
-        """
-        Export weather features for each date from dates to .tsv file.
-
-        Args:
-            filename (str): name of target file
-            dates (list): list of dates (datetime.date)
-            interp_points (list of dicts): list of interpolation points with each point represented
-                as dict with fields 'lon' and 'lat' representing longtitude and lattitude
-
-        Returns:
-            pandas.DataFrame: resulting object with weather measurements
-        """
-        # export all dates
-        dates = np.unique(sorted([dt.date() for dt in self.grib_msgs.validDateTime]))
-        # get interpolation points
-        lats, lons = self.grib_msgs.iloc[0]['lats'], self.grib_msgs.iloc[0]['lons']
-        target_lats, target_lons = self._latslons_from_dict(interp_points)
-        # only keep the values from closest point to each target
-        closest = self._calc_closest(target_lats, target_lons, lats, lons)
-        # weather features frame
-        tf = self.grib_msgs
-        # index on the predicted date
-        tf = tf.set_index('validityDateTime', drop=False)
-        tf = tf.sort_index()
-        # feature collection
-        feat_rows = list()
-        # used weather parameters
-        if weather_params == 'all': weather_params = np.unique(tf['shortName'])
-        # used weather regions
-        if regions == 'all': regions = list(range(len(interp_points)))
-        # used forecast base_date offsets
-        if forecast_offsets == 'all': forecast_offsets = list(range(-11, 1))
-        # interpolate all values
-        tf['values'] = tf['values'].apply(lambda x: x[closest])
-        for curr_date_pos, curr_date in enumerate(dates):
-            # process current date
-            start_day = datetime.datetime.combine(curr_date, datetime.time(0,0))
-            end_day = datetime.datetime.combine(curr_date, datetime.time(23,59))
-            # forecast data regarding current date
-            cf = tf.loc[start_day:end_day]
-            # group by all unique dates on which forecast was made and weather parameters
-            date_params_groups = cf.groupby(['validDateTime', 'shortName'])
-            for group_name in date_params_groups.groups:
-                pdf = date_params_groups.get_group(group_name)
-                # are we interested in the forecast from day_offset days before?
-                base_date = pdf['validDateTime'].iloc[0].date()
-                day_offset = (base_date - curr_date).days
-                if day_offset not in forecast_offsets: continue
-                # forecasted params from base_date for date
-                param_name = pdf.iloc[0]['shortName']
-                # WARNING: there is something wrong with ptype
-                if param_name == 'ptype':
-                    continue
-                # are we interested in this parameter?
-                if param_name not in weather_params: continue
-                # feature prefix
-                feat_prefix = 'WEATHERFC%s%03d%s' % ('+' if day_offset >= 0 else '-', abs(day_offset), param_name)
-                # describe accumulated parameter
-                if param_name in ['sund', 'tp', 'sf']: # sun duration, total percitipation, snow fall
-                    for from_hour, to_hour in [(0, 6), (6, 12), (12, 18), (6, 18)]:
-                        cum_from = pdf.loc[datetime.time(from_hour):datetime.time(from_hour)]
-                        if len(cum_from) == 0:
-                            print("base_date: ", base_date, " curr_date: ", curr_date, " param_name: ", param_name, " at: ", from_hour, " missing!")
-                            continue
-                        else:
-                            cum_from = cum_from.iloc[0]['values']
-
-                        cum_to = pdf.loc[datetime.time(to_hour):datetime.time(to_hour)]
-                        if len(cum_to) == 0:
-                            print("base_date: ", base_date, " curr_date: ", curr_date, " param_name: ", param_name, " at: ", from_hour, " missing!")
-                            continue
-                        else:
-                            cum_to = cum_to.iloc[0]['values']
-
-                        for reg in regions:
-                            feat_rows.append({
-                                'validDate': curr_date,
-                                'dayOffset': day_offset,
-                                'region': reg,
-                                'shortName': param_name,
-                                'fromHour': from_hour,
-                                'toHour': to_hour,
-                                'value': cum_to[reg] - cum_from[reg],
-                                'featureName': '%s%03dCUM%02d-%02d' % (feat_prefix, reg, from_hour, to_hour),
-                                'aggFunc': 'cum'
-                            })
-                # describe instant parameter
-                elif param_name in ['2t', 'ws', 'rh', 'sd', 'tcc'] : # temperature, wind-speed, relative humidity, snow depth
-                    for func_name, func in zip(['min', 'mean', 'max'], [np.min, np.mean, np.max]):
-                        for from_hour, to_hour in [(0, 6), (6, 12), (12, 18), (6, 18)]:
-                            range_values = pdf.loc[datetime.time(from_hour, 0):datetime.time(to_hour, 0)]
-                            for reg in regions:
-                                feat_rows.append({
-                                    'validDate': curr_date,
-                                    'dayOffset': day_offset,
-                                    'region': reg,
-                                    'shortName': param_name,
-                                    'fromHour': from_hour,
-                                    'toHour': to_hour,
-                                    'value': func(range_values['values'].apply(lambda x: x[reg])),
-                                    'featureName': '%s%03d%s%02d-%02d' % (feat_prefix, reg, func_name.upper(), from_hour, to_hour),
-                                    'aggFunc': func_name
-                                })
-
-        feat_df = pd.DataFrame.from_dict(feat_rows)
-        feat_df.to_csv(filename, sep='\t', index=False)
-
-class WeatherApi:
-    """
-    Interface for downloading weather data from MARS.
-
-    Example:
-        $ wa = WeatherApi()
-    """
-
-    def __init__(self, source, key=None, email=None):
-        """
-        Args:
-            source (str): 'owm' for OpenWeatherMaps or 'ecmwf' 
-        """
-        assert source in ['ecmwf', 'owm']
-        
-        self.source = source
-        if source == 'ecmwf':
-            from .request import EcmwfServer
-            self.server = EcmwfServer(key=key, email=email)
-        elif source == 'owm':
-            from .request import OwmServer
-            if key is None:
-                raise ValueError('API key for OpenWeatherMaps has to be specified via "api_key" argument')
-            self.server = OwmServer(api_key=key)
-
-    def get(self, target, from_date=None, to_date=None, base_time='midnight', steps=None, area=None, grid=(0.25, 0.25),
-        city_name=None, city_id=None, latlon=None):
-        """
-        Execute a request with given parameters and store the result to 'target' file.
-
-        Args:
-            from_date (datetime.date): first base date of the forecast, default value is TODAY 
-            to_date (datetime.date): last base date of the forecast, default value equals 'from_date'
-            base_time (str): 'midnight' or 'noon'
-            area: grid area for ECMWF query
-            city_id: id of the city for OpenWeatherMaps query (https://openweathermap.org/forecast5)
-            lonlat: longitude and latitude for OpenWeatherMaps query
-        """
-        assert isinstance(from_date, datetime.date) or from_date is None
-        if from_date is None: 
-            from_date = datetime.date.today()
-        assert isinstance(to_date, datetime.date) or to_date is None
-        if to_date is not None:
-            assert from_date <= to_date
-        assert base_time in ['midnight', 'noon']
-        
-        if self.source == 'ecmwf':
-            from .request import WeatherReq
-
-            # create new request
-            req = WeatherReq()
-
-            # set date
-            req.set_date(from_date, end_date=to_date)
-
-            # set target grib file
-            req.set_target(target)
-
-            # set base time
-            if base_time == 'midnight':
-                req.set_midnight()
-            else:
-                req.set_noon()
-
-            if steps is None:
-                # assume base time is 'midnight'
-                # base_date is the date the forecast was made
-                steps = []
-
-                # current day + next three days
-                for day_off in range(4):
-                    steps += [day_off * 24 +
-                                hour_off for hour_off in [0, 3, 6, 9, 12, 15, 18, 21]]
-
-                # other 4 days
-                for day_off in range(4, 8):
-                    steps += [day_off * 24 +
-                                hour_off for hour_off in [0, 6, 12, 18]]
-
-                if base_time == 'noon':
-                    steps = [step for step in steps in step - 12 >= 0]
-
-            req.set_step(steps)
-
-            if area is None:
-                raise ValueError('No area is specified for ECMWF query.')
-            req.set_area(area)
-        
-            # set grid resolution
-            req.set_grid(grid)
-
-            self.server.retrieve(req)
-
-        elif self.source == 'owm':
-            params = {}
-            if sum(x is not None for x in [city_name, city_id, latlon]) != 1:
-                raise ValueError('Exactly one of the fields city_name, city_id and lonlat needs to be specified.')
-            
-            if city_name is not None:
-                params['q'] = city_name
-            elif city_id is not None:
-                params['id'] = city_id
-            elif latlon is not None:
-                params['lat'] = latlon[0]
-                params['lon'] = latlon[1]
-            
-            self.server.retrieve(params, target)
-        else:
+#!/usr/bin/python
+"""
+Module for downloading and using ECMWF weather data.
+
+There are two important classes:
+    * WeatherApi: used for downloading GRIB files from MARS
+    * WeatherExtractor: used for querying weather data from a pre-downloaded GRIB file
+
+Example:
+    Examples of class usages are given in class docstring.
+
+Todo:
+    * add interpolation capability to WeatherExtractor._aggregate_points
+"""
+from __future__ import print_function
+import datetime
+import io
+import json
+import mmap
+import os
+import pickle
+import struct
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _interp_one(values, closest):
+    """ Take for each target point the value of its closest grid point. """
+    return values[closest]
+
+
+def _interp_mean(values, closest, num_original, num_targets):
+    """ Average the values of all grid points mapped to each target point. """
+    result_values = np.bincount(closest, weights=values, minlength=num_targets)
+    result_count = np.bincount(closest, minlength=num_targets).astype(np.float64)
+    result_count[result_count == 0] = 1.  # avoid dividing by zero
+    return result_values / result_count
+
+
+def _write_tsv(df, filename):
+    """ Write an exported feature frame as a tab-separated file.
+
+    Uses pyarrow's multithreaded CSV writer when available and falls back
+    to pandas to_csv with a large chunk size for buffered writing. Both
+    paths produce the same bytes, so downstream consumers see one format
+    whether or not pyarrow is installed.
+    """
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError:
+        # explicit large write buffer - few big syscalls instead of one
+        # flush per to_csv chunk
+        with io.BufferedWriter(open(filename, 'wb', buffering=0),
+                               buffer_size=4 * 1024 * 1024) as buf:
+            df.to_csv(buf, sep='\t', index=False, chunksize=100000)
+        return
+    # match to_csv serialization: second-resolution timestamps, '270.0'-style
+    # floats and empty fields for missing values
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if (pd.api.types.is_datetime64_any_dtype(df[col])
+                or pd.api.types.is_float_dtype(df[col])):
+            df[col] = df[col].astype(str).where(df[col].notna(), '')
+    with open(filename, 'wb') as f:
+        # write the header ourselves - pyarrow always quotes header fields
+        f.write(('\t'.join(df.columns) + '\n').encode('utf-8'))
+        pa_csv.write_csv(
+            pa.Table.from_pandas(df, preserve_index=False), f,
+            write_options=pa_csv.WriteOptions(
+                delimiter='\t', include_header=False, quoting_style='none'))
+
+
+def _window_agg(window):
+    """ Column-wise min, mean and max of one hour-window block.
+
+    An empty window yields NaN for every column, like the empty-Series
+    reductions the export used before the window slicing was vectorized.
+    """
+    if window.shape[0] == 0:
+        nans = np.full(window.shape[1], np.nan)
+        return nans, nans.copy(), nans.copy()
+    return window.min(axis=0), window.mean(axis=0), window.max(axis=0)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _window_agg(window):
+        n_rows, n_cols = window.shape
+        if n_rows == 0:
+            # degrade to NaN features like the NumPy version
+            mins = np.full(n_cols, np.nan)
+            return mins, mins.copy(), mins.copy()
+        mins = np.empty(n_cols)
+        maxs = np.empty(n_cols)
+        sums = np.empty(n_cols)
+        for j in range(n_cols):
+            v = window[0, j]
+            mins[j] = v
+            maxs[j] = v
+            sums[j] = v
+        for i in range(1, n_rows):
+            for j in range(n_cols):
+                v = window[i, j]
+                # 'v != v' catches NaN so it propagates like np.min/np.max
+                if v < mins[j] or v != v:
+                    mins[j] = v
+                if v > maxs[j] or v != v:
+                    maxs[j] = v
+                sums[j] += v
+        return mins, sums / n_rows, maxs
+
+    @numba.njit(cache=True)
+    def _interp_mean(values, closest, num_original, num_targets):
+        result_values = np.zeros(num_targets)
+        result_count = np.zeros(num_targets)
+        for i in range(num_original):
+            c = closest[i]
+            result_values[c] += values[i]
+            result_count[c] += 1.
+        for j in range(num_targets):
+            if result_count[j] > 0.:
+                result_values[j] /= result_count[j]
+        return result_values
+
+"""
+    Best estimation for actual weather is forecast with a base date on the current day.
+
+    Parameter name:                 Short name:
+
+    2 metre dewpoint temperature        2d
+    2 metre temperature                 2t
+    10 metre U wind component           10u
+    10 metre V wind component           10v
+    Precipitation type**                ptype
+    Snow depth                          sd
+    Snow fall                           sf
+    Sunshine duration*                  sund
+    Surface pressure                    sp
+    Total cloud cover                   tcc
+    Total precipitation*                tp
+    Visibility [m]                      vis
+
+    Wind speed*** [m/s]                 ws
+    Relative humidity*** [%]            rh
+
+    *accumulated from the beginning of the forecast
+    **mean aggregation of this parameter makes no sense
+    ***calculated parameter
+
+    Precipitation type (ptype) code table:
+        0 = No precipitation
+        1 = Rain
+        3 = Freezing rain (i.e. supercooled)
+        5 = Snow
+        6 = Wet snow (i.e. starting to melt)
+        7 = Mixture of rain and snow
+        8 = Ice pellets
+
+    Warning:
+        * after 2015-5-13 number of parameters changes
+"""
+class WeatherExtractor:
+    """
+    Interface for extracting weather data from pre-downloaded GRIB file.
+    Each GRIB file is a collection of self contained weather messages.
+
+    It supports actual weather queries ( via .get_actual(...) ) and forecasted weather
+    queries ( via .get_forecast(...) )
+
+    Examples
+        $ we = WeatherExtractor()
+        $ we.load('example_data.grib')
+
+        Queries about actual weather have the following format:
+
+            $ wa.get_actual(from_date, to_date, aggtime)
+
+            Where:
+                from_date, to_date: time window in days
+                aggtime: aggregation of weather data on different levels:
+                    aggtime='hour': aggregate by hour
+                    aggtime='day': aggregation by day
+                    aggtime='week': aggregation by week
+
+        Queries about forecasted weather have the following format:
+
+            $ wa.get_forecast(base_date, from_date, to_date, aggtime)
+
+            Where:
+                from_date, to_date: time window in days
+                aggtime: aggregation of weather data on different levels:
+                    aggtime='hour': aggregate by hour
+                    aggtime='day': aggregation by day
+                    aggtime='week': aggregation by week
+
+    """
+
+    def __init__(self):
+        self.grib_msgs = None
+        # structure-of-arrays storage: one contiguous (n_msgs, n_grid) value
+        # matrix and a single shared grid, set up by _normalize_storage
+        self.values_matrix = None
+        self.grid_lats = None
+        self.grid_lons = None
+        # lazily built spatial indices, keyed by the identity of the
+        # target (lats, lons) arrays - the grid arrays are shared across
+        # messages so repeated queries reuse the same tree
+        self._tree_cache = {}
+        # resolved closest-point indices, reused across queries with the
+        # same grid and target points
+        self._closest_cache = {}
+        # day-resolution copy of the index for O(log N) date-window slicing
+        self._day_index = None
+
+    def _load_from_grib(self, filepath, grib_reader):
+        """ Load measurements from GRIB file. """
+        # load grib messages
+        grib_messages = []
+        lats, lons = None, None
+
+        if grib_reader[1] == 'eccodes':
+            grbs = grib_reader[0](filepath)
+            for i in range(len(grbs)):
+                grib_msg = grbs.next()
+
+                if lats is None:
+                    lats = grib_msg['latitudes'].flatten().astype(np.float32)
+                    lons = grib_msg['longitudes'].flatten().astype(np.float32)
+
+                # store raw 'YYYYMMDDHHMM' strings - they are parsed in one
+                # vectorized pd.to_datetime pass after the loop
+                grib_messages.append({
+                    'shortName': grib_msg['shortName'],
+                    # GRIB source precision is ~16 bits - float32 loses
+                    # nothing and halves memory bandwidth downstream
+                    'values': grib_msg['values'].flatten().astype(np.float32),
+                    'validDateTime':
+                        str(grib_msg['date']) + str(grib_msg['time']).zfill(4),
+                    'validityDateTime':
+                        str(grib_msg['validityDate']) + str(grib_msg['validityTime']).zfill(4),
+                    'lats': lats,
+                    'lons': lons,
+                    'type': grib_msg['marsType']  # forecast or actual
+                })
+            grbs.close()
+        else:
+            grbs = grib_reader[0](filepath)
+        
+            lats, lons = grbs.message(1).latlons()
+            lats = lats.flatten().astype(np.float32)
+            lons = lons.flatten().astype(np.float32)
+            
+            grbs.rewind()
+            for grib_msg in grbs:
+                grib_messages.append({
+                    'shortName': grib_msg.shortName,
+                    'values': grib_msg.values.flatten().astype(np.float32),
+                    'validDateTime': grib_msg.validDate,
+                    'validityDateTime':
+                        str(grib_msg.validityDate) + str(grib_msg.validityTime).zfill(4),
+                    'lats': lats,
+                    'lons': lons,
+                    'type': grib_msg.marsType  # forecast or actual
+                })
+            grbs.close()
+
+        grib_msgs = pd.DataFrame.from_dict(grib_messages)
+        # parse the accumulated date strings with pandas' C parser instead of
+        # calling _str_to_datetime per message
+        for col in ['validDateTime', 'validityDateTime']:
+            if len(grib_msgs) > 0 and isinstance(grib_msgs[col].iloc[0], str):
+                grib_msgs[col] = pd.to_datetime(
+                    grib_msgs[col], format='%Y%m%d%H%M', cache=True)
+        return grib_msgs
+
+    def _load_from_pkl(self, filepath):
+        """ Load already processed pandas.DataFrame. """
+        grib_msgs = self._unpickle(filepath)
+        return self._attach_values_matrix(grib_msgs, filepath)
+
+    def _load_from_feather(self, filepath):
+        """ Load measurements stored in feather format. """
+        from pyarrow import feather
+        grib_msgs = feather.read_feather(filepath, memory_map=True)
+        grid = np.load(filepath + '.grid.npz')
+        grib_msgs['lats'] = [grid['lats']] * len(grib_msgs)
+        grib_msgs['lons'] = [grid['lons']] * len(grib_msgs)
+        return self._attach_values_matrix(grib_msgs, filepath)
+
+    def _attach_values_matrix(self, grib_msgs, filepath):
+        """ Re-attach the values stored in a .npy sidecar next to filepath. """
+        if 'values' in grib_msgs.columns:
+            # self-contained file from before the sidecar split
+            return grib_msgs
+        matrix_path = filepath + '.npy'
+        if not os.path.exists(matrix_path):
+            raise FileNotFoundError(
+                "Missing value matrix sidecar '%s' - it is written by "
+                "store() next to '%s' and both files must be copied "
+                "together." % (matrix_path, filepath))
+        # re-attach the value rows as views into the memory-mapped
+        # matrix - only pages that queries actually touch are faulted in
+        values_matrix = np.load(matrix_path, mmap_mode='r')
+        grib_msgs['values'] = list(values_matrix)
+        return grib_msgs
+
+    def _unpickle(self, filepath):
+        """ Unpickle a DataFrame, with out-of-band buffers if present. """
+        sidecar = filepath + '.npbuf'
+        if os.path.exists(sidecar):
+            # reconstruct the out-of-band ndarray buffers zero-copy from the
+            # memory-mapped sidecar file written by store()
+            with open(sidecar, 'rb') as bf:
+                mm = mmap.mmap(bf.fileno(), 0, access=mmap.ACCESS_COPY)
+            view = memoryview(mm)
+            buffers, offset = [], 0
+            while offset < len(mm):
+                (length,) = struct.unpack_from('<Q', view, offset)
+                offset += 8
+                buffers.append(view[offset:offset + length])
+                offset += length
+            with open(filepath, 'rb') as f:
+                return pickle.load(f, buffers=buffers)
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)
+
+    def _load_from_owmjson(self, filepath):
+        """ Load measurements from OpenWeatherMap json response. """
+        # Convert to the same 'grib messages' format as ecmwf data
+        grib_messages = []
+        
+        with open(filepath, 'r') as f:
+            d = json.loads(f.read())
+        
+        # one shared coordinate array referenced by every message row
+        lats = np.array([d['city']['coord']['lat']], dtype=np.float32)
+        lons = np.array([d['city']['coord']['lon']], dtype=np.float32)
+        validDateTime = pd.to_datetime(d['list'][0]['dt_txt'])
+
+        def __add_msg(name, value, validityDateTime):
+            grib_messages.append({
+                'shortName': name,
+                'values': np.array([value]),
+                'validDateTime': pd.to_datetime(validDateTime.date()),
+                'validityDateTime': validityDateTime,
+                'lats': lats,
+                'lons': lons,
+                'type': 'fc'
+            })
+
+        # Total precipitation is accumulated parameter in ECMWF (in [m])
+        # make it accumulated also for OWM
+        tp_acc = 0.0
+
+        for msg in d['list']:
+            validityDateTime = pd.to_datetime(msg['dt_txt'])
+            
+            __add_msg('2t', msg['main']['temp'], validityDateTime)
+            __add_msg('rh', msg['main']['humidity'] / 100.0, validityDateTime)
+            __add_msg('sp', msg['main']['grnd_level'] / 100.0, validityDateTime)
+            __add_msg('tcc', msg['clouds']['all'] / 100.0 if 'clouds' in msg else 0.0, validityDateTime)
+            __add_msg('ws', msg['wind']['speed'] if 'wind' in msg else 0.0, validityDateTime)
+            if 'rain' in msg and '3h' in msg['rain']:
+                tp_acc += msg['rain']['3h'] / 1000.0 # in [mm] originally
+            __add_msg('tp', tp_acc, validityDateTime)
+            __add_msg('sf', msg['snow']['3h'] / 100.0 if 'snow' in msg else 0.0, validityDateTime)
+            
+        return pd.DataFrame.from_dict(grib_messages)
+
+    def load(self, filepaths, format=None, parallel=False):
+        """
+        Load weather data from grib file obtained via API request or from
+        the pickled pandas.DataFrame.
+
+        Arguments:
+            filepaths (list): list of paths to files containing weather data
+            format (str): one of the following:
+                'grib': files are stored in grib format
+                'pkl': files are stored in binary form (pickled)
+                'feather': files are stored in feather format
+                'owm': files are stored in OpenWeatherMap json format
+
+                if format is not specified it is automatically inferred from file prefix
+                (.grib, .pkl, .feather or .json)
+            parallel (bool): read the files with a thread pool; GRIB decoders
+                release the GIL during native calls so multi-file loads scale
+                with the number of cores
+
+        Warning:
+            after 2015-5-13 number of parameters increases from 11 to 15 and
+            additional parameter 'ptype' which disturbs the indexing
+            (because of inconsistent 'validDateTime') sneaks in
+        """
+        if not isinstance(filepaths, list):
+            filepaths = [filepaths]  # wrap in list
+        
+        grib_reader = None
+        if format is None:
+            if all(f.endswith('.grib') for f in filepaths):
+                format = 'grib'
+
+                try:
+                    import eccodes
+                    grib_reader = (eccodes.GribFile, 'eccodes')
+                except ImportError:
+                    import pygrib
+                    grib_reader = (pygrib.open, 'pygrib')
+                print('Using ', grib_reader[1], ' as GRIB decoder.')
+
+            elif all(f.endswith('.pkl') for f in filepaths):
+                format = 'pkl'
+            elif all(f.endswith('.feather') for f in filepaths):
+                format = 'feather'
+            elif all(f.endswith('.json') for f in filepaths):
+                format = 'owm'
+            else:
+                raise ValueError("Could not infer the file format.")
+
+        if format == 'grib':
+            loader = lambda filepath: self._load_from_grib(filepath, grib_reader)
+        elif format == 'pkl':
+            loader = self._load_from_pkl
+        elif format == 'feather':
+            loader = self._load_from_feather
+        elif format == 'owm':
+            loader = self._load_from_owmjson
+        else:
+            raise ValueError("Format %s not recognized" % format)
+
+        # collect per-file frames and concatenate exactly once
+        parts = [] if self.grib_msgs is None else [self.grib_msgs]
+        if parallel and len(filepaths) > 1:
+            with ThreadPoolExecutor(
+                    max_workers=min(len(filepaths), os.cpu_count() or 1)) as executor:
+                parts += list(executor.map(loader, filepaths))
+        else:
+            for filepath in filepaths:
+                parts.append(loader(filepath))
+
+        if len(parts) == 1:
+            self.grib_msgs = parts[0]
+            self.grib_msgs.reset_index(drop=True, inplace=True)
+        else:
+            self.grib_msgs = pd.concat(parts, ignore_index=True)
+
+        # extend the set of parameters if data is from grib files
+        if format == 'grib':
+            self.grib_msgs = WeatherExtractor._extend_parameters(self.grib_msgs)
+
+        # repack into structure-of-arrays form
+        self._normalize_storage()
+
+        # index by base date (date when the forecast was made)
+        self.grib_msgs.set_index('validDateTime', drop=False, inplace=True)
+        self.grib_msgs.sort_index(inplace=True)
+        self._day_index = self.grib_msgs.index.normalize().values.astype('datetime64[D]')
+
+    def _slice_days(self, from_date, to_date):
+        """ Slice messages whose base date falls in [from_date, to_date] with
+        a binary search over the day-normalized index. """
+        if self._day_index is None or len(self._day_index) != len(self.grib_msgs):
+            self._day_index = self.grib_msgs.index.normalize().values.astype('datetime64[D]')
+        lo = np.searchsorted(self._day_index, np.datetime64(from_date), side='left')
+        hi = np.searchsorted(self._day_index, np.datetime64(to_date), side='right')
+        return self.grib_msgs.iloc[lo:hi]
+
+    def _normalize_storage(self):
+        """ Repack the per-message value arrays into one contiguous float32
+        matrix and share a single lats/lons array across all messages.
+
+        The 'values' cells become row views into self.values_matrix, so the
+        DataFrame keeps its schema while the data lives in one block that
+        vectorized code can scan directly.
+        """
+        if self.grib_msgs is None or len(self.grib_msgs) == 0:
+            return
+        values = self.grib_msgs['values'].values
+        base = getattr(values[0], 'base', None)
+        if self._rows_are_matrix(values, base):
+            # rows are already in-order views into one shared (possibly
+            # memory-mapped) matrix - adopt it instead of copying everything
+            # back into RAM
+            self.values_matrix = base
+        else:
+            self.values_matrix = np.stack(values).astype(np.float32, copy=False)
+            self.grib_msgs['values'] = list(self.values_matrix)
+        self.grid_lats = np.asarray(self.grib_msgs['lats'].iloc[0])
+        self.grid_lons = np.asarray(self.grib_msgs['lons'].iloc[0])
+        self.grib_msgs['lats'] = [self.grid_lats] * len(self.grib_msgs)
+        self.grib_msgs['lons'] = [self.grid_lons] * len(self.grib_msgs)
+
+    @staticmethod
+    def _rows_are_matrix(values, base):
+        """ Check that cell i is exactly row i of the shared 2D base array.
+
+        A permuted frame (e.g. after sort_index) still holds views of the
+        same base, so checking only view membership would adopt a matrix
+        whose row order disagrees with the frame.
+        """
+        if not (isinstance(base, np.ndarray) and base.ndim == 2
+                and len(values) == base.shape[0]):
+            return False
+        base_addr = base.__array_interface__['data'][0]
+        row_stride = base.strides[0]
+        return all(v.base is base
+                   and v.__array_interface__['data'][0] == base_addr + i * row_stride
+                   for i, v in enumerate(values))
+
+    def store(self, filepath):
+        if filepath.endswith('.feather'):
+            return self._store_feather(filepath)
+        if not filepath.endswith('.pkl'):
+            filepath += '.pkl'
+        print("Saving weather data to: %s" % filepath)
+        grib_msgs = self.grib_msgs
+        if 'values' in grib_msgs.columns:
+            # save the big value matrix separately so _load_from_pkl can
+            # memory-map it; only the small metadata frame gets pickled.
+            # stack from the frame itself - self.values_matrix may predate
+            # sort_index and be row-permuted relative to the metadata
+            np.save(filepath + '.npy',
+                    np.stack(grib_msgs['values'].to_numpy()).astype(np.float32, copy=False))
+            grib_msgs = grib_msgs.drop(columns=['values'])
+        buffers = []
+        with open(filepath, 'wb') as f:
+            pickle.dump(grib_msgs, f, protocol=5,
+                        buffer_callback=buffers.append)
+        # raw ndarray buffers go length-prefixed into a sidecar file so they
+        # can be handed back to pickle.load without copying
+        with open(filepath + '.npbuf', 'wb') as f:
+            for buf in buffers:
+                raw = buf.raw()
+                f.write(struct.pack('<Q', raw.nbytes))
+                f.write(raw)
+
+    def _store_feather(self, filepath):
+        """ Store weather data in feather format - safe against malicious
+        pickles and LZ4-compressed, with the value matrix in a memory-mappable
+        .npy sidecar and the shared grid in a .grid.npz sidecar. """
+        from pyarrow import feather
+
+        print("Saving weather data to: %s" % filepath)
+        if self.values_matrix is None:
+            self._normalize_storage()
+        meta = self.grib_msgs.drop(
+            columns=['values', 'lats', 'lons']).reset_index(drop=True)
+        feather.write_feather(meta, filepath, compression='lz4')
+        # stack from the frame itself - self.values_matrix may predate
+        # sort_index and be row-permuted relative to the metadata
+        np.save(filepath + '.npy',
+                np.stack(self.grib_msgs['values'].to_numpy()).astype(np.float32, copy=False))
+        np.savez(filepath + '.grid.npz',
+                 lats=self.grid_lats, lons=self.grid_lons)
+
+    @staticmethod
+    def _extend_parameters(grib_msgs):
+        """ Extend the set of weather parameters with ones calculated
+        from base parameters.
+        """
+        print("Extending parameters...")
+        curr_params = np.unique(grib_msgs.shortName)
+
+        def _aligned_values(name_a, name_b):
+            """ Align the messages of two parameters by (validDateTime,
+            validityDateTime) and stack their values into two matrices. """
+            part_a = grib_msgs[grib_msgs.shortName == name_a].set_index(
+                ['validDateTime', 'validityDateTime']).sort_index()
+            part_b = grib_msgs[grib_msgs.shortName == name_b].set_index(
+                ['validDateTime', 'validityDateTime']).sort_index()
+            common = part_a.index.intersection(part_b.index)
+            part_a, part_b = part_a.loc[common], part_b.loc[common]
+            return (part_a,
+                    np.stack(part_a['values'].values),
+                    np.stack(part_b['values'].values))
+
+        derived = []
+
+        # calculate Wind speed [ws] parameter
+        if ('10u' in curr_params) and '10v' in curr_params and not 'ws' in curr_params:
+            meta, u_mat, v_mat = _aligned_values('10u', '10v')
+
+            new_msgs = meta.reset_index()
+            new_msgs['shortName'] = u'ws'
+            new_msgs['values'] = list(np.hypot(u_mat, v_mat))
+            derived.append(new_msgs)
+
+        # calculate Relative humidity (rh) parameter
+        if '2t' in curr_params and '2d' in curr_params and not 'rh' in curr_params:
+            T0 = 273.15
+
+            # get dewpoint temperature and surface temperature
+            meta, t_mat, d_mat = _aligned_values('2t', '2d')
+            T_surface = t_mat - T0
+            T_dew = d_mat - T0
+
+            # calculate relative humidity using https://journals.ametsoc.org/doi/pdf/10.1175/BAMS-86-2-225
+            rh = 100*(np.exp((17.625*T_dew)/(243.04+T_dew))/np.exp((17.625*T_surface)/(243.04+T_surface)))
+
+            new_msgs = meta.reset_index()
+            new_msgs['shortName'] = u'rh'
+            new_msgs['values'] = list(rh)
+            derived.append(new_msgs)
+
+        if derived:
+            grib_msgs = pd.concat([grib_msgs] + derived, ignore_index=True)
+
+        return grib_msgs
+
+    def _grid_latslons(self):
+        """ Get the shared grid coordinates without materializing a row. """
+        if self.grid_lats is not None:
+            return self.grid_lats, self.grid_lons
+        return self.grib_msgs['lats'].iloc[0], self.grib_msgs['lons'].iloc[0]
+
+    def _latslons_from_dict(self, points):
+        """ Get lattitudes and longtitudes from list of points. """
+        assert isinstance(points, list)
+
+        n_points = len(points)
+        lats, lons = np.zeros(n_points), np.zeros(n_points)
+        for i, point in enumerate(points):
+            lats[i], lons[i] = point['lat'], point['lon']
+        return (lats, lons)
+
+    def _calc_closest(self, lats, lons, target_lats, target_lons):
+        """
+        For each point Pi = (lats[i], lons[i]) calculate the closest point Pj = (target_lats[j], target_lons[j])
+        according to euclidean distance.
+
+        Args:
+            lats, lons (np.array(dtype=float)): latitudes and longtitudes of original points
+            target_lats, target_lons (np.array(dtype=float)): latitudes and longtitudes of target points
+
+        Returns:
+            np.array(dtype=int): array where value at index i represents the index of closest point j
+        """
+        # query a k-d tree built on the target points instead of computing
+        # the full N x M distance matrix
+        cache_key = (id(target_lats), id(target_lons))
+        tree = self._tree_cache.get(cache_key)
+        if tree is None:
+            tree = cKDTree(np.c_[target_lats, target_lons])
+            self._tree_cache[cache_key] = tree
+        _, closest = tree.query(np.c_[lats, lons], k=1, workers=-1)
+        return closest.astype(np.intp)
+
+    def _interpolate_values(self, values, closest, num_original, num_targets, aggtype):
+        """
+        Do a value interpolation for given target points according to aggregation type.
+
+        Args:
+            values (np.array(dtype=float)): original values
+            closest (np.array(dtype=int)):
+            num_original (int):
+            num_targets (int):
+            aggtype (str):
+
+        Returns:
+            np.array(dtype=float): interpolated values for target points
+        """
+        # get interpolated values
+        if aggtype == 'one':
+            return _interp_one(values, closest)
+        elif aggtype == 'mean':
+            return _interp_mean(
+                np.asarray(values, dtype=np.float64), closest, num_original, num_targets)
+
+    @staticmethod
+    def _str_to_datetime(val):
+        """ Convert datetime string 'YYYYMMDDHHMM' to datetime object. """
+        tmp_date = datetime.date(int(val[:4]), int(val[4:6]), int(val[6:8]))
+
+        time_str = val[8:]
+        assert len(time_str) in [1, 3, 4]
+        if len(time_str) == 1:
+            # midnight - only one number
+            return datetime.datetime.combine(tmp_date, datetime.time(int(time_str)))
+        elif len(time_str) == 3:
+            # hmm format
+            return datetime.datetime.combine(tmp_date, datetime.time(int(time_str[:1]), int(time_str[1:])))
+        elif len(time_str) == 4:
+            # hhmm format
+            return datetime.datetime.combine(tmp_date, datetime.time(int(time_str[:2]), int(time_str[2:])))
+
+    def _aggregate_points(self, weather_result, aggloc, aggtype='one', interp_points=None, bounding_box=None):
+        """
+        Do an interpolation of measurement values for target points (given with target_lats and target_lons)
+        from weather_result points.
+
+        Args:
+            weather_result (pandas.DataFrame): object containing original measurements and points
+            aggloc (str): aggregation level
+            aggtype (str): aggregation type, can be one of the following:
+
+                'one' - keep only the value of a grid point which is closest to the target point
+                'mean' - calculate the mean value of all grid points closest to the target point
+
+                TODO:
+                    'interpolate' - do a kind of ECMWF interpolation
+
+        Returns:
+            pandas.DataFrame: resulting object with interpolated points
+        """
+        assert aggloc in ['grid', 'points', 'country', 'bbox']
+        assert aggtype in ['one', 'mean']
+        if aggloc == 'grid':  # no aggregation
+            return weather_result
+        if aggloc == 'points':
+            assert interp_points is not None
+        assert len(weather_result) > 0
+
+        lats, lons = weather_result['lats'].iloc[0], weather_result['lons'].iloc[0]
+        grid_index = None  # grid subset selected by the bounding box
+
+        if aggloc == 'bbox':
+            assert bounding_box is not None, "bounding box not given"
+            assert len(bounding_box) == 2 and len(bounding_box[0]) == 2 and len(bounding_box[1]) == 2, \
+                "Wrong bounding box input structure"
+            # get bounding box borders
+            bb_min_lat = min(bounding_box[0][0], bounding_box[1][0])
+            bb_max_lat = max(bounding_box[0][0], bounding_box[1][0])
+            bb_min_lon = min(bounding_box[0][1], bounding_box[1][1])
+            bb_max_lon = max(bounding_box[0][1], bounding_box[1][1])
+            # get data borders
+            min_lat, max_lat = min(lats), max(lats)
+            min_lon, max_lon = min(lons), max(lons)
+            # check if bounding box is within data
+            assert min_lat <= bb_min_lat <= max_lat, "bounding box must be within data area"
+            assert min_lat <= bb_max_lat <= max_lat, "bounding box must be within data area"
+            assert min_lon <= bb_min_lon <= max_lon, "bounding box must be within data area"
+            assert min_lon <= bb_max_lon <= max_lon, "bounding box must be within data area"
+            # filter out bounding box points with one vectorized mask
+            bb_mask = (lats >= bb_min_lat) & (lats <= bb_max_lat) & \
+                (lons >= bb_min_lon) & (lons <= bb_max_lon)
+            assert bb_mask.any(), "bounding box contains no points"
+            grid_index = np.flatnonzero(bb_mask)
+            lats, lons = lats[grid_index], lons[grid_index]
+
+        if aggloc == 'points':
+            target_lats, target_lons = interp_points[0], interp_points[1]
+        elif aggloc == 'country':  # center of slovenia
+            target_lats, target_lons = np.array([46.1512]), np.array([14.9955])
+        elif aggloc == 'bbox': # aggregate over bounding box
+            # compute mid point of bounding box
+            mid_bbox = [0.5 * (bb_min_lat + bb_max_lat), 0.5 * (bb_min_lon + bb_max_lon)]
+            target_lats, target_lons = np.array([mid_bbox[0]]), np.array([mid_bbox[1]])
+
+        cache_key = (aggtype, id(lats), id(lons),
+                     target_lats.tobytes(), target_lons.tobytes())
+        closest = self._closest_cache.get(cache_key)
+        if closest is None:
+            if aggtype == 'one':
+                # each target point has only one closest grid point
+                closest = self._calc_closest(target_lats, target_lons, lats, lons)
+            elif aggtype == 'mean':
+                # each grid point has only one closest target point
+                closest = self._calc_closest(lats, lons, target_lats, target_lons)
+            self._closest_cache[cache_key] = closest
+
+        num_targets = target_lats.shape[0]
+        num_rows = len(weather_result)
+
+        # stack the per-message values into a single (num_rows, num_grid)
+        # matrix and interpolate all rows with one vectorized operation
+        values_matrix = np.vstack(weather_result['values'].values)
+        if grid_index is not None:
+            # keep the value columns aligned with the bbox-filtered grid
+            values_matrix = values_matrix[:, grid_index]
+        if aggtype == 'one':
+            new_values = values_matrix[:, closest]
+        elif aggtype == 'mean':
+            # group the grid points by their target bucket once, then reduce
+            # each bucket with sequential reads instead of scattered writes
+            order = np.argsort(closest, kind='stable')
+            counts = np.bincount(closest, minlength=num_targets)
+            nonempty = np.flatnonzero(counts)
+            boundaries = np.searchsorted(closest[order], nonempty)
+            sums = np.zeros((num_rows, num_targets))
+            sums[:, nonempty] = np.add.reduceat(
+                values_matrix[:, order], boundaries, axis=1)
+            new_values = sums / np.maximum(counts, 1)
+
+        tmp_result = weather_result.copy()
+        tmp_result['values'] = list(new_values)
+        tmp_result['lats'] = [target_lats] * num_rows
+        tmp_result['lons'] = [target_lons] * num_rows
+        return tmp_result
+
+    def _aggregate_values(self, weather_result, aggtime):
+        """
+        Aggregate weather values on hourly, daily or weekly level. Calculate the mean
+        value for each measurement point over given time period.
+
+        Serves more as an aggregation example. For more complex aggregations set aggtime='hour'
+        and implement own aggregation policy on pandas.DataFrame.
+
+        Args:
+            weather_result (pandas.DataFrame): object containing original measurements
+            aggtime (str): aggregation level which can be 'hour', 'day' or 'week'
+
+        Returns:
+            pandas.DataFrame: resulting object with aggregated values
+        """
+        assert aggtime in ['hour', 'day', 'week', 'H', 'D', 'W']
+        aggtime = {'hour': 'H', 'day': 'D', 'week': 'W'}[aggtime]
+
+        if aggtime == 'H':
+            return weather_result
+
+        weather_result.set_index(
+            ['validDateTime', 'validityDateTime', 'shortName'], drop=True, inplace=True)
+
+        groups = weather_result.groupby([pd.Grouper(freq='D', level='validDateTime'), pd.Grouper(
+            freq=aggtime, level='validityDateTime'), pd.Grouper(level='shortName')])
+
+        # use pandas' native aggregations instead of a Python callback per group
+        tmp_result = pd.concat(
+            [groups['values'].mean(), groups[['lats', 'lons']].first()], axis=1)
+        tmp_result.reset_index(drop=False, inplace=True)
+
+        return tmp_result
+
+    def get_actual(self, from_date, to_date, aggtime='hour', aggloc='grid', interp_points=None, bounding_box=None):
+        """
+        Get the actual weather for each day from a given time window.
+        Actual weather is actually a forecast made on given day - this is the best weather estimation
+        we can get.
+
+        Args:
+            from_date (datetime.date): start of the timewindow
+            to_date (datetime.date): end of the timewindow
+            aggtime (str): time aggregation level; can be 'hour', 'day' or 'week'
+            aggloc (str): location aggregation level; can be country', 'points', 'grid' or 'bbox'
+            interp_points (list of dicts): list of interpolation points with each point represented
+                as dict with fields 'lon' and 'lat' representing longtitude and lattitude if aggloc='points'
+            bounding_box ([[lat1,lon1], [lat2,lon2]]): corner points of the bounding box if aggloc='bounding_box',
+                order of the points is not important
+
+        Returns:
+            pandas.DataFrame: resulting object with weather measurements
+        """
+        assert type(from_date) == datetime.date
+        assert type(to_date) == datetime.date
+        assert from_date <= to_date
+        assert aggtime in ['hour', 'day', 'week']
+        assert aggloc in ['country', 'points', 'grid', 'bbox']
+
+        if aggloc == 'points':
+            if interp_points is None:
+                raise ValueError(
+                    "interp_points cannot be None if aggloc is set to 'points'.")
+            interp_points = self._latslons_from_dict(interp_points)
+        if aggloc == 'bounding_box':
+            if bounding_box is None:
+                raise ValueError(
+                    "bounding_box cannot be None if aggloc is set to 'bounding_box'.")
+
+        req_period = self._slice_days(from_date, to_date)
+        # compare whole days as datetime64[D] - stays in C instead of
+        # allocating a Python date object per row
+        valid_days = req_period['validDateTime'].values.astype('datetime64[D]')
+        validity_days = req_period['validityDateTime'].values.astype('datetime64[D]')
+        tmp_result = req_period[valid_days == validity_days]
+
+        # drop 'type' column
+        tmp_result.drop('type', axis=1, inplace=True)
+
+        # reset original index
+        tmp_result.reset_index(drop=True, inplace=True)
+
+        # point aggregation
+        aggtype = 'mean' if aggloc == 'bbox' else 'one'
+        tmp_result = self._aggregate_points(
+            tmp_result, aggloc, aggtype=aggtype, interp_points=interp_points, bounding_box=bounding_box)
+
+        # time aggregation
+        tmp_result = self._aggregate_values(tmp_result, aggtime)
+
+        return tmp_result
+
+    def get_forecast(self, base_date, from_date, to_date, aggtime='hour', aggloc='grid', interp_points=None,
+        bounding_box=None):
+        """
+        Get the weather forecast for a given time window from a given date.
+
+        Args:
+            base_date (datetime.date): base date for the forecast
+            from_date (datetime.date): start of the time window
+            end_date (datetime.date): end of the timewindow
+            aggtime (str): time aggregation level; can be 'hour', 'day' or 'week'
+            aggloc (str): location aggregation level; can be 'country', 'points', 'grid' or 'bbox'
+            interp_points (list of dicts): list of interpolation points with each point represented
+                as dict with fields 'lon' and 'lat' representing longtitude and lattitude if aggloc='points'
+            bounding_box ([[lat1,lon1], [lat2,lon2]]): corner points of the bounding box if aggloc='bbox',
+                order of the points is not important
+
+        Returns:
+            pandas.DataFrame: resulting object with weather measurements
+        """
+        assert type(base_date) == datetime.date
+        assert type(from_date) == datetime.date
+        assert type(to_date) == datetime.date
+        assert base_date <= from_date <= to_date
+        assert aggtime in ['hour', 'day', 'week']
+        assert aggloc in ['country', 'points', 'grid', 'bbox']
+
+        if aggloc == 'points':
+            if interp_points is None:
+                raise ValueError(
+                    "interp_points cannot be None if aggloc is set to 'points'.")
+            interp_points = self._latslons_from_dict(interp_points)
+        if aggloc == 'bounding_box':
+            if bounding_box is None:
+                raise ValueError(
+                    "bounding_box cannot be None if aggloc is set to 'bounding_box'.")
+
+        req_period = self._slice_days(base_date, base_date)
+
+        # start with default (hourly) aggregation; one datetime64[D] range
+        # mask instead of two row-wise .dt.date comparisons
+        validity_days = req_period['validityDateTime'].values.astype('datetime64[D]')
+        tmp_result = req_period[(validity_days >= np.datetime64(from_date)) &
+                                (validity_days <= np.datetime64(to_date))]
+
+        # drop 'type' column
+        tmp_result.drop('type', axis=1, inplace=True)
+
+        # reset original index
+        tmp_result.reset_index(drop=True, inplace=True)
+
+        # point aggregation
+        aggtype = 'mean' if aggloc == 'bbox' else 'one'
+        tmp_result = self._aggregate_points(
+            tmp_result, aggloc, aggtype=aggtype, interp_points=interp_points, bounding_box=bounding_box)
+
+        # time aggregation
+        tmp_result = self._aggregate_values(tmp_result, aggtime)
+
+        return tmp_result
+
+    def export_qminer(self, filename, interp_points):
+        """
+        Export weather features for each date from dates to .tsv file.
+
+        Args:
+            filename (str): name of target file
+            interp_points (list of dicts): list of interpolation points with each point represented
+                as dict with fields 'lon' and 'lat' representing longtitude and lattitude
+        Returns:
+            pandas.DataFrame: resulting object with weather measurements
+        """
+        # export all dates
+        dates = np.unique(sorted([dt.date() for dt in self.grib_msgs.validDateTime]))
+        # get interpolation points
+        lats, lons = self._grid_latslons()
+        target_lats, target_lons = self._latslons_from_dict(interp_points)
+        # only keep the values from closest point to each target; a compact
+        # int32 index stream halves the memory traffic of the column gather
+        closest = np.ascontiguousarray(
+            self._calc_closest(target_lats, target_lons, lats, lons), dtype=np.int32)
+        # weather features frame
+        tf = self.grib_msgs
+        # index on the predicted date
+        tf = tf.set_index('validityDateTime', drop=False)
+        tf = tf.sort_index()
+        # WARNING: there is something wrong with ptype parameter
+        tf = tf[tf.shortName != 'ptype']
+        # interpolate all values in one fancy-indexed take
+        vals = np.stack(tf['values'].values)[:, closest]
+        n_rows, n_points = vals.shape
+
+        day_offset = (tf['validityDateTime'] - tf['validDateTime']).dt.days.values
+
+        # build the long-form frame directly - each message row expands to
+        # one row per region - instead of one apply-column per point + melt
+        rf = pd.DataFrame({
+            'param': np.repeat(tf['shortName'].values, n_points),
+            'timestamp': np.repeat(tf['validityDateTime'].values, n_points),
+            'dayOffset': np.repeat(day_offset, n_points),
+            'region': np.tile(np.arange(n_points, dtype=np.int32), n_rows),
+            'value': vals.ravel()
+        })
+
+        rf.sort_values(by=['timestamp', 'region'], inplace=True)
+        _write_tsv(rf, filename)
+
+    def export_db(self, filename):
+        """
+        Export weather features to tsv file in MariaDB format.
+
+        Args:
+            filename (str): name of target file
+        Returns:
+            pandas.DataFrame: resulting object with weather measurements
+        """
+        # weather features frame
+        df = self.grib_msgs.reset_index(drop=True)
+        lats, lons = self._grid_latslons()
+        n_grid = len(lats)
+
+        # one parameter column per shortName, aligned over the timestamps
+        pivot = df.pivot_table(
+            index=['validDateTime', 'validityDateTime'], columns='shortName',
+            values='values', aggfunc='first')
+        n_groups = len(pivot)
+
+        valid_times = pivot.index.get_level_values('validDateTime')
+        validity_times = pivot.index.get_level_values('validityDateTime')
+        # integer timedelta divide - no float seconds round-trip
+        offsets = np.asarray((validity_times - valid_times) // pd.Timedelta(hours=1))
+
+        # expand to one row per grid point per timestamp with repeat/tile
+        # instead of building a small DataFrame per group
+        new_columns = {
+            'date': np.repeat(valid_times.values, n_grid),
+            'offset': np.repeat(offsets, n_grid),
+            'latitude': np.tile(np.asarray(lats), n_groups),
+            'longitude': np.tile(np.asarray(lons), n_groups)
+        }
+        for param_name in pivot.columns:
+            new_columns[param_name] = np.concatenate([
+                np.asarray(v) if isinstance(v, np.ndarray) else np.full(n_grid, np.nan)
+                for v in pivot[param_name].values])
+
+        df = pd.DataFrame(new_columns)
+        df.sort_values(by=['date', 'offset'], inplace=True)
+        _write_tsv(df, filename)
+
+    def _group_rows_polars(self, tf):
+        """ Group message rows by (validity day, base date, parameter) with
+        polars and return the same key -> row-index mapping produced by
+        pandas groupby(...).indices. """
+        import polars as pl
+        frame = pl.DataFrame({
+            'validityDate': tf['validityDateTime'].values.astype('datetime64[D]'),
+            'validDateTime': tf['validDateTime'].values,
+            'shortName': tf['shortName'].to_numpy(),
+            'row': np.arange(len(tf)),
+        })
+        grouped = frame.group_by(
+            ['validityDate', 'validDateTime', 'shortName'], maintain_order=True).agg(pl.col('row'))
+        return {(curr_date, base_datetime, param_name): np.asarray(rows)
+                for curr_date, base_datetime, param_name, rows in grouped.iter_rows()}
+
+    def export(self, filename, interp_points, weather_params='all', forecast_offsets='all', regions='all',
+               engine='pandas', parallel=False):
+        """
+        Export weather features for each date from dates to .tsv file.
+
+        Args:
+            filename (str): name of target file
+            dates (list): list of dates (datetime.date)
+            interp_points (list of dicts): list of interpolation points with each point represented
+                as dict with fields 'lon' and 'lat' representing longtitude and lattitude
+            engine (str): 'pandas' (default) or 'polars' - which library performs
+                the grouping pass over the messages; 'polars' requires the
+                optional polars package and can be faster on very large runs
+            parallel (bool): process the exported groups with a thread pool;
+                the per-group work is mostly NumPy and releases the GIL
+
+        Returns:
+            pandas.DataFrame: resulting object with weather measurements
+        """
+        # export all dates
+        dates = np.unique(sorted([dt.date() for dt in self.grib_msgs.validDateTime]))
+        # get interpolation points
+        lats, lons = self._grid_latslons()
+        target_lats, target_lons = self._latslons_from_dict(interp_points)
+        # only keep the values from closest point to each target; a compact
+        # int32 index stream halves the memory traffic of the column gather
+        closest = np.ascontiguousarray(
+            self._calc_closest(target_lats, target_lons, lats, lons), dtype=np.int32)
+        # weather features frame
+        tf = self.grib_msgs
+        # index on the predicted date
+        tf = tf.set_index('validityDateTime', drop=False)
+        tf = tf.sort_index()
+        # used weather parameters - frozenset turns the per-group membership
+        # check into a single hash probe
+        if weather_params == 'all': weather_params = np.unique(tf['shortName'])
+        weather_params = frozenset(weather_params)
+        # group on category codes instead of raw strings
+        tf['shortName'] = tf['shortName'].astype('category')
+        # used weather regions
+        if regions == 'all': regions = list(range(len(interp_points)))
+        regions_arr = np.asarray(regions)
+        n_regions = len(regions)
+        # used forecast base_date offsets
+        if forecast_offsets == 'all': forecast_offsets = list(range(-11, 1))
+        # interpolate all values into one (n_msgs, n_points) matrix; rows
+        # carry their matrix index so inner loops use fancy indexing only.
+        # column-major layout keeps each region column contiguous for the
+        # axis-0 window reductions
+        values_matrix = np.asfortranarray(np.stack(tf['values'].values)[:, closest])
+        # integer hour per message - avoids repeated .loc[time:time] label
+        # slicing over the DatetimeIndex in the hour-window loops
+        hour_arr = np.asarray(tf.index.hour)
+        dates_set = set(dates)
+        # one grouping pass over (validity day, base date, parameter) instead
+        # of re-slicing the DatetimeIndex for every exported date
+        if engine == 'polars':
+            date_params_groups = self._group_rows_polars(tf)
+        elif engine == 'pandas':
+            date_params_groups = tf.groupby(
+                [tf['validityDateTime'].dt.date, 'validDateTime', 'shortName']).indices
+        else:
+            raise ValueError("Unknown engine: %s" % repr(engine))
+
+        # the region/window part of each feature name is group-independent -
+        # format it once and only prepend the per-group prefix in the loop
+        name_suffixes = {}
+        for tag in ['CUM', 'MIN', 'MEAN', 'MAX']:
+            for from_hour, to_hour in [(0, 6), (6, 12), (12, 18), (6, 18)]:
+                name_suffixes[(tag, from_hour, to_hour)] = [
+                    '%03d%s%02d-%02d' % (reg, tag, from_hour, to_hour) for reg in regions]
+
+        def process_groups(group_items):
+            """ Emit feature rows for a contiguous run of groups. """
+            # preallocated feature columns - upper bound: a group emits at
+            # most 3 functions x 4 hour windows x |regions| rows
+            n_max = len(group_items) * 12 * n_regions
+            col_valid_date = np.empty(n_max, dtype=object)
+            col_day_offset = np.empty(n_max, dtype=np.int64)
+            col_region = np.empty(n_max, dtype=np.int64)
+            col_short_name = np.empty(n_max, dtype=object)
+            col_from_hour = np.empty(n_max, dtype=np.int64)
+            col_to_hour = np.empty(n_max, dtype=np.int64)
+            col_value = np.empty(n_max, dtype=np.float64)
+            col_feature_name = np.empty(n_max, dtype=object)
+            col_agg_func = np.empty(n_max, dtype=object)
+            k = 0
+
+            for group_name, rows in group_items:
+                curr_date, base_datetime, param_name = group_name
+                if curr_date not in dates_set: continue
+                # are we interested in the forecast from day_offset days before?
+                base_date = base_datetime.date()
+                day_offset = (base_date - curr_date).days
+                if day_offset not in forecast_offsets: continue
+                # WARNING: there is something wrong with ptype
+                if param_name == 'ptype':
+                    continue
+                # are we interested in this parameter?
+                if param_name not in weather_params: continue
+                # feature prefix
+                feat_prefix = 'WEATHERFC%s%03d%s' % ('+' if day_offset >= 0 else '-', abs(day_offset), param_name)
+                # hours are sorted within the group - binary search instead of
+                # label slicing
+                hours = hour_arr[rows]
+                # describe accumulated parameter
+                if param_name in ['sund', 'tp', 'sf']: # sun duration, total percitipation, snow fall
+                    for from_hour, to_hour in [(0, 6), (6, 12), (12, 18), (6, 18)]:
+                        idx_from = np.searchsorted(hours, from_hour)
+                        if idx_from == len(hours) or hours[idx_from] != from_hour:
+                            print("base_date: ", base_date, " curr_date: ", curr_date, " param_name: ", param_name, " at: ", from_hour, " missing!")
+                            continue
+                        cum_from = values_matrix[rows[idx_from]]
+
+                        idx_to = np.searchsorted(hours, to_hour)
+                        if idx_to == len(hours) or hours[idx_to] != to_hour:
+                            print("base_date: ", base_date, " curr_date: ", curr_date, " param_name: ", param_name, " at: ", from_hour, " missing!")
+                            continue
+                        cum_to = values_matrix[rows[idx_to]]
+
+                        # emit all regions at once - one vector subtract instead
+                        # of a Python iteration per region
+                        sl = slice(k, k + n_regions)
+                        col_valid_date[sl] = curr_date
+                        col_day_offset[sl] = day_offset
+                        col_region[sl] = regions_arr
+                        col_short_name[sl] = param_name
+                        col_from_hour[sl] = from_hour
+                        col_to_hour[sl] = to_hour
+                        col_value[sl] = cum_to[regions_arr] - cum_from[regions_arr]
+                        col_feature_name[sl] = [feat_prefix + s
+                                                for s in name_suffixes[('CUM', from_hour, to_hour)]]
+                        col_agg_func[sl] = 'cum'
+                        k += n_regions
+                # describe instant parameter
+                elif param_name in ['2t', 'ws', 'rh', 'sd', 'tcc'] : # temperature, wind-speed, relative humidity, snow depth
+                    for from_hour, to_hour in [(0, 6), (6, 12), (12, 18), (6, 18)]:
+                        lo = np.searchsorted(hours, from_hour, side='left')
+                        hi = np.searchsorted(hours, to_hour, side='right')
+                        if hi == lo:
+                            # no messages in this window - emit NaN feature
+                            # rows, like the empty-Series reductions in the
+                            # baseline, on both the numba and NumPy paths
+                            nan_row = np.full(n_regions, np.nan)
+                            window_aggs = (nan_row, nan_row, nan_row)
+                        else:
+                            # slice the window once and compute all three
+                            # aggregates over it in a single pass - each
+                            # reduction produces every region at once
+                            range_matrix = values_matrix[rows[lo:hi]][:, regions_arr]
+                            window_aggs = _window_agg(range_matrix)
+                        for func_name, agg_values in zip(['min', 'mean', 'max'], window_aggs):
+                            sl = slice(k, k + n_regions)
+                            col_valid_date[sl] = curr_date
+                            col_day_offset[sl] = day_offset
+                            col_region[sl] = regions_arr
+                            col_short_name[sl] = param_name
+                            col_from_hour[sl] = from_hour
+                            col_to_hour[sl] = to_hour
+                            col_value[sl] = agg_values
+                            col_feature_name[sl] = [feat_prefix + s
+                                                    for s in name_suffixes[(func_name.upper(), from_hour, to_hour)]]
+                            col_agg_func[sl] = func_name
+                            k += n_regions
+
+            return (col_valid_date[:k], col_day_offset[:k], col_region[:k],
+                    col_short_name[:k], col_from_hour[:k], col_to_hour[:k],
+                    col_value[:k], col_feature_name[:k], col_agg_func[:k])
+
+        sorted_groups = sorted(date_params_groups.items())
+        if parallel and len(sorted_groups) > 1:
+            # contiguous chunks of groups per worker - chunking by groups
+            # beats per-group dispatch, and threads share the stacked value
+            # matrix without pickling it
+            n_chunks = min(os.cpu_count() or 1, len(sorted_groups))
+            bounds = np.linspace(0, len(sorted_groups), n_chunks + 1).astype(int)
+            with ThreadPoolExecutor(max_workers=n_chunks) as executor:
+                chunk_results = list(executor.map(
+                    process_groups,
+                    [sorted_groups[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]))
+        else:
+            chunk_results = [process_groups(sorted_groups)]
+
+        columns = [np.concatenate(cols) for cols in zip(*chunk_results)]
+        feat_df = pd.DataFrame({
+            'validDate': columns[0],
+            'dayOffset': columns[1],
+            'region': columns[2],
+            'shortName': columns[3],
+            'fromHour': columns[4],
+            'toHour': columns[5],
+            'value': columns[6],
+            'featureName': columns[7],
+            'aggFunc': columns[8]
+        })
+        _write_tsv(feat_df, filename)
+
+class WeatherApi:
+    """
+    Interface for downloading weather data from MARS.
+
+    Example:
+        $ wa = WeatherApi()
+    """
+
+    def __init__(self, source, key=None, email=None):
+        """
+        Args:
+            source (str): 'owm' for OpenWeatherMaps or 'ecmwf' 
+        """
+        assert source in ['ecmwf', 'owm']
+        
+        self.source = source
+        if source == 'ecmwf':
+            from .request import EcmwfServer
+            self.server = EcmwfServer(key=key, email=email)
+        elif source == 'owm':
+            from .request import OwmServer
+            if key is None:
+                raise ValueError('API key for OpenWeatherMaps has to be specified via "api_key" argument')
+            self.server = OwmServer(api_key=key)
+
+    def get(self, target, from_date=None, to_date=None, base_time='midnight', steps=None, area=None, grid=(0.25, 0.25),
+        city_name=None, city_id=None, latlon=None):
+        """
+        Execute a request with given parameters and store the result to 'target' file.
+
+        Args:
+            from_date (datetime.date): first base date of the forecast, default value is TODAY 
+            to_date (datetime.date): last base date of the forecast, default value equals 'from_date'
+            base_time (str): 'midnight' or 'noon'
+            area: grid area for ECMWF query
+            city_id: id of the city for OpenWeatherMaps query (https://openweathermap.org/forecast5)
+            lonlat: longitude and latitude for OpenWeatherMaps query
+        """
+        assert isinstance(from_date, datetime.date) or from_date is None
+        if from_date is None: 
+            from_date = datetime.date.today()
+        assert isinstance(to_date, datetime.date) or to_date is None
+        if to_date is not None:
+            assert from_date <= to_date
+        assert base_time in ['midnight', 'noon']
+        
+        if self.source == 'ecmwf':
+            from .request import WeatherReq
+
+            # create new request
+            req = WeatherReq()
+
+            # set date
+            req.set_date(from_date, end_date=to_date)
+
+            # set target grib file
+            req.set_target(target)
+
+            # set base time
+            if base_time == 'midnight':
+                req.set_midnight()
+            else:
+                req.set_noon()
+
+            if steps is None:
+                # assume base time is 'midnight'
+                # base_date is the date the forecast was made
+                # 3-hourly over the current day + next three days, 6-hourly
+                # over the four days after that
+                steps = np.concatenate(
+                    [np.arange(0, 96, 3), np.arange(96, 192, 6)])
+
+                # a noon run covers the same horizon shifted by 12 hours
+                if base_time == 'noon':
+                    steps = steps[steps - 12 >= 0]
+
+                steps = steps.tolist()
+
+            req.set_step(steps)
+
+            if area is None:
+                raise ValueError('No area is specified for ECMWF query.')
+            req.set_area(area)
+        
+            # set grid resolution
+            req.set_grid(grid)
+
+            self.server.retrieve(req)
+
+        elif self.source == 'owm':
+            params = {}
+            if sum(x is not None for x in [city_name, city_id, latlon]) != 1:
+                raise ValueError('Exactly one of the fields city_name, city_id and lonlat needs to be specified.')
+            
+            if city_name is not None:
+                params['q'] = city_name
+            elif city_id is not None:
+                params['id'] = city_id
+            elif latlon is not None:
+                params['lat'] = latlon[0]
+                params['lon'] = latlon[1]
+            
+            self.server.retrieve(params, target)
+        else:
             raise ValueError('Invalid weather source: %s' % self.source)
\ No newline at end of file